@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 
-import urllib.request
+import http.client
+import urllib.parse
+from pathlib import Path
+import hashlib
 import xml.etree.ElementTree as ET
 import board
 import neopixel
@@ -9,6 +12,22 @@ import time
 import datetime
 import threading
 import logging
+import numpy as np
+try:
+	from numba import njit
+except ImportError:
+	def njit(*args, **kwargs):	# no numba available - run the kernels as plain Python
+		return lambda f: f
+try:
+	import astral.geocoder	# Astral 2.x, newer Raspberry Pi versions using Python 3.6+
+	import astral.sun
+	ASTRAL_V2 = True
+except ImportError:
+	ASTRAL_V2 = False
+	try:
+		import astral	# Astral 1.10.1, older clients running python 3.5
+	except ImportError:
+		astral = None
 try:
 	import displaymetar
 except ImportError:
@@ -69,24 +88,44 @@ DISPLAY_ROTATION_SPEED = 5.0				# Float in seconds, e.g 2.0 for two seconds
 FAST_BLINK_DISPLAYED_STATION = True			# If true, the station shown on the display blinks fast
 FAST_BLINK_SPEED = 0.1						#...this fast
 
-DONTSTOP = -1							# use this to tell the STOPFLAG not to signal any stoppages; just needs to be a number outside the thread range
-STOPFLAG = DONTSTOP
-
 # ---------------------------------------------------------------------------
 # ------------END OF CONFIGURATION-------------------------------------------
 # ---------------------------------------------------------------------------
+
+# Keep one HTTPS connection to the data server open across refreshes so we don't redo DNS/TLS every time
+METAR_HOST = "www.aviationweather.gov"
+METAR_HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/86.0.4240.198 Safari/537.36 Edg/86.0.622.69'}
+_conn = http.client.HTTPSConnection(METAR_HOST, timeout=30)
+logger = logging.getLogger(__name__)
+
+_AIRPORTS_PATH = Path("/MetarMap/airports")
+_airports_cache = (None, 0.0)	# (airports array, mtime of the file it was read from)
+_last_hash = None		# digest of the last request path + response we parsed, to spot unchanged weather
+_last_conditions = None
+
+# LED colors indexed by category id; stations with lightning use the last row
+CATEGORY_NAMES = ["", "VFR", "MVFR", "IFR", "LIFR"]
+CATEGORY_INDEX = {name: i for i, name in enumerate(CATEGORY_NAMES) if name}
+LIGHTNING_INDEX = 5
+PALETTE = np.array([COLOR_CLEAR, COLOR_VFR, COLOR_MVFR, COLOR_IFR, COLOR_LIFR, COLOR_LIGHTNING], dtype=np.uint8)
+
 def initialize_logging():
 	logging.basicConfig(filename='metar.log', level=logging.INFO)
 
+def led_brightness():
+	# Brightness to run the LEDs at for the current time of day
+	bright = BRIGHT_TIME_START < datetime.datetime.now().time() < DIM_TIME_START
+	return(LED_BRIGHTNESS_DIM if (ACTIVATE_DAYTIME_DIMMING and bright == False) else LED_BRIGHTNESS)
+
 def initialize_display_and_leds():
 	# Initialize the LED strip
-	bright = BRIGHT_TIME_START < datetime.datetime.now().time() < DIM_TIME_START
-	logging.info (timestamp()+"Wind animation: %s", str(ACTIVATE_WINDCONDITION_ANIMATION))
-	logging.info (timestamp()+"Daytime Dimming: %s", str(ACTIVATE_DAYTIME_DIMMING))
-	logging.info(timestamp()+" using Sunrise/Sunset" if USE_SUNRISE_SUNSET and ACTIVATE_DAYTIME_DIMMING else "")
-	logging.info(timestamp()+"External Display: %s " , str(ACTIVATE_EXTERNAL_METAR_DISPLAY))
+	logger.info("%sWind animation: %s", timestamp(), ACTIVATE_WINDCONDITION_ANIMATION)
+	logger.info("%sDaytime Dimming: %s", timestamp(), ACTIVATE_DAYTIME_DIMMING)
+	if USE_SUNRISE_SUNSET and ACTIVATE_DAYTIME_DIMMING:
+		logger.info("%s using Sunrise/Sunset", timestamp())
+	logger.info("%sExternal Display: %s ", timestamp(), ACTIVATE_EXTERNAL_METAR_DISPLAY)
 
-	p = neopixel.NeoPixel(LED_PIN, LED_COUNT, brightness = LED_BRIGHTNESS_DIM if (ACTIVATE_DAYTIME_DIMMING and bright == False) else LED_BRIGHTNESS, pixel_order = LED_ORDER, auto_write = False)
+	p = neopixel.NeoPixel(LED_PIN, LED_COUNT, brightness = led_brightness(), pixel_order = LED_ORDER, auto_write = False)
 
 	# Start up external display output
 	disp = None
@@ -97,179 +136,319 @@ def initialize_display_and_leds():
 	return(p,disp)
 
 
-def blinkme(pixelnum,color,time,blinkrate):    #time = time in seconds to blink for ; blinkrate = time in seconds of a blink cycle (<< time)
-        numblinks = int(time/blinkrate)
-        for i in range(numblinks):
-                pixels[pixelnum]=COLOR_CLEAR
-                pixels.show()
-                sleep(blinkrate/2)
-                pixels[pixelnum]=color
-                pixels.show()
-                sleep(blinkrate/2)
-                # check for stopping flag for this pixel
-                global STOPFLAG
-                if STOPFLAG == pixelnum:
-                	break
-        return
-
-''' Illustration of threading the above function
-#prepare thread
-x = threading.Thread(target=blinkme, args=(2,COLOR_MVFR,5,.1))
-x.start()
-y = threading.Thread(target=blinkme, args=(3,COLOR_LIFR,5,1))
-y.start()
-# to stop the thread, set STOPFLAG to the pixel number to stop, then join the thread
-'''
+class BlinkScheduler:
+	# A single worker thread that does all the LED animation: it blinks every windy pixel together and fast-blinks the
+	# station on the external display, and calls pixels.show() at most once per tick however many pixels changed
+	def __init__(self, pixels, blinkrate, fastrate):
+		self.pixels = pixels
+		self.blinkrate = blinkrate
+		self.fastrate = fastrate
+		self.lock = threading.RLock()	# guards the blink state and all writes to pixels
+		self._blinking = []		# (pixelnum, color) for each windy pixel
+		self._toggle = False		# True while the windy pixels are blanked
+		self._next_toggle = time.monotonic()
+		self._fast = None		# (pixelnum, color, end time) of the pixel being fast blinked
+		self._fast_on = False
+		self._next_fast = 0.0
+		self._wake = threading.Event()	# set to cut the current wait short, e.g. for a new blink set
+		self._thread = threading.Thread(target=self._run, daemon=True)
+		self._thread.start()
+
+	def set_state(self, targets):	# targets = list of (pixelnum, color, windy); pixels past the end of the strip are ignored
+		with self.lock:
+			n = len(self.pixels)
+			self._blinking = [(p, color) for (p, color, windy) in targets if windy and p < n]
+			self._fast = None	# drop any overlay from the old weather so it can't restore a stale color over the new frame
+			# the caller has just shown the new frame with every pixel lit; leave it up for half a cycle before blanking
+			self._toggle = False
+			self._next_toggle = time.monotonic() + self.blinkrate/2
+		self._wake.set()
+
+	def set_fast_blink(self, pixelnum, color, duration):	# fast blink one pixel for duration seconds, then put it back to its normal state
+		if pixelnum >= len(self.pixels):
+			return
+		with self.lock:
+			if self._fast is not None and self._fast[0] != pixelnum:
+				self._restore(self._fast[0], self._fast[1])
+			self._fast = (pixelnum, color, time.monotonic() + duration)
+			self._fast_on = False
+			self._next_fast = 0.0
+		self._wake.set()
+
+	def _restore(self, pixelnum, color):	# call with the lock held
+		windy = any(p == pixelnum for (p, c) in self._blinking)
+		self.pixels[pixelnum] = COLOR_CLEAR if (windy and self._toggle) else color
+
+	def _run(self):
+		while True:	# runs for the life of the process (daemon thread)
+			try:
+				deadline = self._tick()
+			except Exception:
+				# keep animating; a dead daemon thread would silently stop all blinking
+				logger.exception("%sError in LED animation", timestamp())
+				deadline = time.monotonic() + self.blinkrate/2
+			if self._wake.wait(max(0.0, deadline - time.monotonic())):
+				self._wake.clear()
+
+	def _tick(self):	# update whichever pixels are due and return the time of the next deadline
+		now = time.monotonic()
+		with self.lock:
+			changed = False
+			fastpixel = self._fast[0] if self._fast is not None else None
+			if now >= self._next_toggle:
+				self._toggle = not self._toggle
+				self._next_toggle = now + self.blinkrate/2
+				for (p, color) in self._blinking:
+					if p != fastpixel:
+						self.pixels[p] = COLOR_CLEAR if self._toggle else color
+						changed = True
+			if self._fast is not None:
+				p, color, end = self._fast
+				if now >= end:
+					self._fast = None
+					self._restore(p, color)
+					changed = True
+				elif now >= self._next_fast:
+					self._fast_on = not self._fast_on
+					self.pixels[p] = COLOR_CLEAR if self._fast_on else color
+					self._next_fast = now + self.fastrate/2
+					changed = True
+			if changed:
+				self.pixels.show()
+			return(self._next_toggle if self._fast is None else min(self._next_toggle, self._next_fast, self._fast[2]))
 
 def timestamp():
 	return time.strftime("%Y/%m/%d-%H:%M:%S ",time.localtime())
 
+def _sun_v1(location):
+	city = astral.Astral()[location]
+	print(city)
+	return(city.sun(date = datetime.datetime.now().date(), local = True))
+
+def _sun_v2(location):
+	city = astral.geocoder.lookup(location, astral.geocoder.database())
+	logger.info("%s%s", timestamp(), city)
+	return(astral.sun.sun(city.observer, date = datetime.datetime.now().date(), tzinfo=city.timezone))
+
+# Sunrise/sunset lookup for whichever Astral API is installed, picked once at import
+_get_sun = None if astral is None else (_sun_v2 if ASTRAL_V2 else _sun_v1)
+
 def calc_daytime():
 # Figure out sunrise/sunset times if astral is being used
-	try:
-        	import astral
-	except ImportError:
-        	astral = None
-
-	if astral is not None and USE_SUNRISE_SUNSET:
+	global BRIGHT_TIME_START, DIM_TIME_START
+	if _get_sun is not None and USE_SUNRISE_SUNSET:
 		try:
-			# For older clients running python 3.5 which are using Astral 1.10.1
-			ast = astral.Astral()
-			try:
-				city = ast[LOCATION]
-			except KeyError:
-				logging.error(timestamp()+"Error: Location not recognized, please check list of supported cities and reconfigure")
-			else:
-				print(city)
-				sun = city.sun(date = datetime.datetime.now().date(), local = True)
-				BRIGHT_TIME_START = sun['sunrise'].time()
-				DIM_TIME_START = sun['sunset'].time()
-		except AttributeError:
-			# newer Raspberry Pi versions using Python 3.6+ using Astral 2.2
-			import astral.geocoder
-			import astral.sun
-			try:
-				city = astral.geocoder.lookup(LOCATION, astral.geocoder.database())
-			except KeyError:
-				logging.error(timestamp()+"Error: Location not recognized, please check list of supported cities and reconfigure")
-			else:
-				logging.info(timestamp()+"%s", city)
-				sun = astral.sun.sun(city.observer, date = datetime.datetime.now().date(), tzinfo=city.timezone)
-				BRIGHT_TIME_START = sun['sunrise'].time()
-				DIM_TIME_START = sun['sunset'].time()
+			sun = _get_sun(LOCATION)
+		except KeyError:
+			logger.error("%sError: Location not recognized, please check list of supported cities and reconfigure", timestamp())
+		else:
+			BRIGHT_TIME_START = sun['sunrise'].time()
+			DIM_TIME_START = sun['sunset'].time()
 	return
 
 def get_airport_list():
-		# Read the airports file to retrieve array of airports and use as order for LEDs
-	with open("/MetarMap/airports") as f:
-		airports = f.readlines()
-	airports = [x.strip() for x in airports]
+		# Read the airports file to retrieve array of airports and use as order for LEDs.  The file is only re-read
+		# when its modification time changes; otherwise the same array object as last time is returned
+	global _airports_cache
+	airports, mtime = _airports_cache
+	st_mtime = _AIRPORTS_PATH.stat().st_mtime
+	if airports is None or st_mtime != mtime:
+		with _AIRPORTS_PATH.open() as f:
+			airports = np.array([x.strip() for x in f], dtype=object)
+		_airports_cache = (airports, st_mtime)
 
 	return(airports)
 
-def get_weather(airports):
-	# Retrieve METAR from aviationweather.gov data server
-	# Details about parameters can be found here: https://www.aviationweather.gov/dataserver/example?datatype=metar
-	url = "https://www.aviationweather.gov/adds/dataserver_current/httpparam?dataSource=metars&requestType=retrieve&format=xml&hoursBeforeNow=5&mostRecentForEachStation=true&stationString=" + ",".join([item for item in airports if item != "NULL"])
-	logging.info (timestamp()+"Retriving from " + url)
+def request_metar_path(path):
+	# GET path over the persistent connection; if the server dropped the idle connection, reconnect once and retry
+	try:
+		_conn.request("GET", path, headers=METAR_HEADERS)
+		return _conn.getresponse()
+	except (ConnectionError, http.client.BadStatusLine):	# broken pipe/reset on a stale keep-alive socket, or the server closed it
+		_conn.close()
+		_conn.request("GET", path, headers=METAR_HEADERS)
+		return _conn.getresponse()
+
+def fetch_metar_response(path):
+	# Returns the response for path once it is a 200, following a single redirect on the same host.  Any other status
+	# raises HTTPException; the body is read off first so the keep-alive connection can be reused
+	response = request_metar_path(path)
+	if response.status in (301, 302, 303, 307, 308):
+		location = response.getheader("Location", "")
+		response.read()
+		logger.warning("%sMETAR request redirected (%d) to %s", timestamp(), response.status, location)
+		target = urllib.parse.urlsplit(location)
+		if target.netloc not in ("", METAR_HOST):
+			raise http.client.HTTPException("HTTP %d redirect to another host: %s" % (response.status, location))
+		response = request_metar_path(urllib.parse.urlunsplit(("", "", target.path, target.query, "")))
+	if response.status != 200:
+		location = response.getheader("Location")
+		response.read()
+		raise http.client.HTTPException("HTTP %d %s%s" % (response.status, response.reason, (" (Location: " + location + ")") if location else ""))
+	return response
+
+def parse_observation_time(t):
+	# METAR times are always YYYY-MM-DDTHH:MM:SSZ, so slice the fields out directly rather than going through fromisoformat
+	try:
+		return datetime.datetime(int(t[0:4]), int(t[5:7]), int(t[8:10]), int(t[11:13]), int(t[14:16]), int(t[17:19]), tzinfo=datetime.timezone.utc)
+	except ValueError:
+		return datetime.datetime.fromisoformat(t.replace("Z","+00:00"))
+
+# METAR child tag -> (condition key, parser for the element text)
+METAR_FIELDS = {
+	"station_id":		("stationId", str),
+	"flight_category":	("flightCategory", str),
+	"wind_dir_degrees":	("windDir", str),
+	"wind_speed_kt":	("windSpeed", int),
+	"wind_gust_kt":		("windGustSpeed", int),
+	"temp_c":		("tempC", lambda t: int(round(float(t)))),
+	"dewpoint_c":		("dewpointC", lambda t: int(round(float(t)))),
+	"visibility_statute_mi":	("vis", lambda t: int(round(float(t)))),
+	"altim_in_hg":		("altimHg", lambda t: float(round(float(t), 2))),
+	"wx_string":		("obs", str),
+	"observation_time":	("obsTime", parse_observation_time),
+	"raw_text":		("lightning", lambda t: t.find('LTG') != -1),
+}
+
+# METAR children that identify an observation, hashed to spot unchanged weather
+METAR_HASH_FIELDS = ("station_id", "observation_time", "raw_text")
+
+def parse_metar(metar, hasher):
+	# Build the condition dictionary for one METAR element in a single pass over its children, feeding its METAR_HASH_FIELDS
+	# into hasher along the way.  Returns None if there is no flight category (the METAR is still hashed)
+	hashed = {}
+	condition = { "stationId": "", "flightCategory" : None, "windDir": "", "windSpeed" : 0, "windGustSpeed" :  0, "windGust" : False, "lightning": False, "tempC" : 0, "dewpointC" : 0, "vis" : 0, "altimHg" : 0.0, "obs" : "", "skyConditions" : [], "obsTime" : datetime.datetime.now(datetime.timezone.utc) }
+	fields_get = METAR_FIELDS.get
+	skyConditions = condition["skyConditions"]
+	for child in metar:
+		tag = child.tag
+		if tag in METAR_HASH_FIELDS:
+			hashed[tag] = child.text or ""
+		if tag == "sky_condition":
+			skyConditions.append({ "cover" : child.get("sky_cover"), "cloudBaseFt": int(child.get("cloud_base_ft_agl", default=0)) })
+			continue
+		field = fields_get(tag)
+		if field is not None:
+			key, parse = field
+			condition[key] = parse(child.text)
+			if key == "windGustSpeed":
+				condition["windGust"] = (ALWAYS_BLINK_FOR_GUSTS or condition["windGustSpeed"] > WIND_BLINK_THRESHOLD)
+	for tag in METAR_HASH_FIELDS:
+		hasher.update(hashed.get(tag, "").encode() + b"\0")
+	if condition["flightCategory"] is None:
+		print("Missing flight condition, skipping.")
+		return None
+	return condition
+
+def get_weather(stations):
+	# Retrieve METAR from aviationweather.gov data server, filling in the StationArrays as well as the returned dictionary.
+	# If the METARs are the same as last time, the previous dictionary object is returned instead of the new one, so callers
+	# can test for "unchanged" with `is` and skip rebuilding the LEDs.  The response is still fully parsed either way, since
+	# it is streamed into the parser and only known to be unchanged once the last METAR has been read
+	global _last_hash, _last_conditions
+	logger.info("%sRetriving from https://%s%s", timestamp(), METAR_HOST, stations.path)
 	try:
-		req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/86.0.4240.198 Safari/537.36 Edg/86.0.622.69'})
-		content = urllib.request.urlopen(req).read()
+		# Hash just the METARs themselves - the response wrapper (request_index, time_taken_ms) changes on every request
+		hasher = hashlib.blake2b("\n".join(stations.codes).encode())
+		response = fetch_metar_response(stations.path)
 	# Retrieve flying conditions from the service response and store in a dictionary for each airport
-		root = ET.fromstring(content)
-		conditionDict = { "NULL": {"flightCategory" : "", "windDir": "", "windSpeed" : 0, "windGustSpeed" :  0, "windGust" : False, "lightning": False, "tempC" : 0, "dewpointC" : 0, "vis" : 0, "altimHg" : 0, "obs" : "", "skyConditions" : {}, "obsTime" : datetime.datetime.now() } }
-		conditionDict.pop("NULL")
-		stationList = []
-		for metar in root.iter('METAR'):
-			stationId = metar.find('station_id').text
-			if metar.find('flight_category') is None:
-				print("Missing flight condition, skipping.")
+	# Stream the XML straight off the socket and handle each METAR as soon as it is complete, rather than building the whole tree first
+		conditionDict = {}
+		stations.clear()
+		data = None
+		for event, elem in ET.iterparse(response, events=("start", "end")):
+			if event == "start":
+				if elem.tag == "data":
+					data = elem
 				continue
-			flightCategory = metar.find('flight_category').text
-			windDir = ""
-			windSpeed = 0
-			windGustSpeed = 0
-			windGust = False
-			lightning = False
-			tempC = 0
-			dewpointC = 0
-			vis = 0
-			altimHg = 0.0
-			obs = ""
-			skyConditions = []
-			if metar.find('wind_gust_kt') is not None:
-				windGustSpeed = int(metar.find('wind_gust_kt').text)
-				windGust = (True if (ALWAYS_BLINK_FOR_GUSTS or windGustSpeed > WIND_BLINK_THRESHOLD) else False)
-			if metar.find('wind_speed_kt') is not None:
-				windSpeed = int(metar.find('wind_speed_kt').text)
-			if metar.find('wind_dir_degrees') is not None:
-				windDir = metar.find('wind_dir_degrees').text
-			if metar.find('temp_c') is not None:
-				tempC = int(round(float(metar.find('temp_c').text)))
-			if metar.find('dewpoint_c') is not None:
-				dewpointC = int(round(float(metar.find('dewpoint_c').text)))
-			if metar.find('visibility_statute_mi') is not None:
-				vis = int(round(float(metar.find('visibility_statute_mi').text)))
-			if metar.find('altim_in_hg') is not None:
-				altimHg = float(round(float(metar.find('altim_in_hg').text), 2))
-			if metar.find('wx_string') is not None:
-				obs = metar.find('wx_string').text
-			if metar.find('observation_time') is not None:
-				obsTime = datetime.datetime.fromisoformat(metar.find('observation_time').text.replace("Z","+00:00"))
-			for skyIter in metar.iter("sky_condition"):
-				skyCond = { "cover" : skyIter.get("sky_cover"), "cloudBaseFt": int(skyIter.get("cloud_base_ft_agl", default=0)) }
-				skyConditions.append(skyCond)
-			if metar.find('raw_text') is not None:
-				rawText = metar.find('raw_text').text
-				lightning = False if rawText.find('LTG') == -1 else True
-			logging.info(timestamp()+stationId + ":" 
-			+ flightCategory + ":" 
-			+ str(windDir) + "@" + str(windSpeed) + ("G" + str(windGustSpeed) if windGust else "") + ":"
-			+ str(vis) + "SM:"
-			+ obs + ":"
-			+ str(tempC) + "/"
-			+ str(dewpointC) + ":"
-			+ str(altimHg) + ":"
-			+ str(lightning))
-			conditionDict[stationId] = { "flightCategory" : flightCategory, "windDir": windDir, "windSpeed" : windSpeed, "windGustSpeed": windGustSpeed, "windGust": windGust, "vis": vis, "obs" : obs, "tempC" : tempC, "dewpointC" : dewpointC, "altimHg" : altimHg, "lightning": lightning, "skyConditions" : skyConditions, "obsTime": obsTime }
-			stationList.append(stationId)
+			if elem.tag != "METAR":
+				continue
+			condition = parse_metar(elem, hasher)
+			# Drop the finished METAR so memory stays bounded to one station at a time
+			elem.clear()
+			if data is not None:
+				data.remove(elem)
+			if condition is None:
+				continue
+			stationId = condition.pop("stationId")
+			if logger.isEnabledFor(logging.INFO):
+				logger.info("%s%s:%s:%s@%d%s:%dSM:%s:%d/%d:%.2f:%s", timestamp(), stationId,
+					condition["flightCategory"],
+					condition["windDir"], condition["windSpeed"], ("G" + str(condition["windGustSpeed"]) if condition["windGust"] else ""),
+					condition["vis"],
+					condition["obs"],
+					condition["tempC"], condition["dewpointC"],
+					condition["altimHg"],
+					condition["lightning"])
+			conditionDict[stationId] = condition
+			stations.update(stationId, condition)
+		digest = hasher.digest()
+		if digest == _last_hash:
+			logger.info("%sWeather unchanged since last refresh", timestamp())
+			return(_last_conditions)
+		_last_hash = digest
+		_last_conditions = conditionDict
 		return(conditionDict)
+	except http.client.HTTPException as e:
+		logger.error("%sError retrieving weather: %s", timestamp(), e)	# the body was drained, so the connection is still usable
+		sleep(10)
 	except:
-		logging.error(timestamp()+"Error retrieving weather, possibly network?")
+		logger.error("%sError retrieving weather, possibly network?", timestamp())
+		_conn.close()	# start from a fresh connection on the next attempt
 		sleep(10)
 
 
-def calc_target_colors (stations, conditions):  # calculate an array of bulb states given the list of stations and dict of conditions.  Returns an array of (color, blink) values
-	target_colors = []
-	for airportcode in stations:
-		windy = False
-		lightningConditions = False
-		color = COLOR_CLEAR
-		# Skip NULL entries
-		if airportcode != "":
-			condition = conditions.get(airportcode, None)
-
-			if condition != None:
-				windy = True if (ACTIVATE_WINDCONDITION_ANIMATION and (condition["windSpeed"] > WIND_BLINK_THRESHOLD or condition["windGust"] == True)) else False
-
-				if condition["lightning"]:
-					color = COLOR_LIGHTNING
-				elif condition["flightCategory"] == "VFR":
-					color = COLOR_VFR
-				elif condition["flightCategory"] == "MVFR":
-					color = COLOR_MVFR
-				elif condition["flightCategory"] == "IFR":
-					color = COLOR_IFR
-				elif condition["flightCategory"] == "LIFR":
-					color = COLOR_LIFR
-				else:
-					color = COLOR_CLEAR
-
-				logging.debug (timestamp()+"Setting LED for " + airportcode + " to " + ("lightning " if lightningConditions else "") + ("windy " if windy else "") + (condition["flightCategory"] if conditions != None else "None") + " " + str(color))
-
-		target_colors.append((color,windy))
-
-	return(target_colors)
+def metar_request_path(airports):
+	# Path and query for the METAR request; details about parameters can be found here: https://www.aviationweather.gov/dataserver/example?datatype=metar
+	return("/adds/dataserver_current/httpparam?dataSource=metars&requestType=retrieve&format=xml&hoursBeforeNow=5&mostRecentForEachStation=true&stationString=" + ",".join([item for item in airports if item != "NULL"]))
+
+class StationArrays:
+	# Weather for each airport held as parallel arrays in LED order (category id, wind speed, gusting, lightning),
+	# filled in place by get_weather and read directly by the color kernel.  Allocate a new one whenever the airport list changes
+	def __init__(self, airports):
+		n = len(airports)
+		self.codes = airports
+		self.path = metar_request_path(airports)
+		self.index = {}		# airport code -> LED positions showing it
+		for p, airportcode in enumerate(airports):
+			if airportcode not in ("", "NULL"):
+				self.index.setdefault(airportcode, []).append(p)
+		self.cat = np.zeros(n, dtype=np.int8)
+		self.wind = np.zeros(n, dtype=np.int16)
+		self.gust = np.zeros(n, dtype=np.bool_)
+		self.lit = np.zeros(n, dtype=np.bool_)
+
+	def clear(self):
+		for a in (self.cat, self.wind, self.gust, self.lit):
+			a.fill(0)
+
+	def update(self, stationId, condition):
+		for p in self.index.get(stationId, ()):
+			self.cat[p] = CATEGORY_INDEX.get(condition["flightCategory"], 0)
+			self.wind[p] = condition["windSpeed"]
+			self.gust[p] = condition["windGust"]
+			self.lit[p] = condition["lightning"]
+
+# Explicit signature so the kernel is compiled at import (and cached on disk) rather than on the first refresh
+@njit("Tuple((uint8[:,:], bool_[:]))(int8[:], int16[:], bool_[:], bool_[:], int16, bool_, uint8[:,:])", cache=True)
+def compute_colors(cat, wind, gust, lit, thresh, anim, palette):	# returns a (N,3) array of colors and a windy flag per station
+	n = cat.shape[0]
+	colors = np.empty((n, 3), dtype=np.uint8)
+	windy = np.zeros(n, dtype=np.bool_)
+	for i in range(n):
+		colors[i, :] = palette[LIGHTNING_INDEX] if lit[i] else palette[cat[i]]
+		windy[i] = anim and (wind[i] > thresh or gust[i])
+	return(colors, windy)
+
+def calc_target_colors (stations):  # calculate bulb states from the StationArrays.  Returns a (N,3) uint8 array of colors and a bool array of blink flags
+	colors, windy = compute_colors(stations.cat, stations.wind, stations.gust, stations.lit, WIND_BLINK_THRESHOLD, ACTIVATE_WINDCONDITION_ANIMATION, PALETTE)
+
+	if logger.isEnabledFor(logging.DEBUG):
+		for airportcode, color, blink, lightning, cat in zip(stations.codes, colors.tolist(), windy, stations.lit, stations.cat):
+			if cat:
+				logger.debug("%sSetting LED for %s to %s%s%s %s", timestamp(), airportcode, ("lightning " if lightning else ""), ("windy " if blink else ""), CATEGORY_NAMES[cat], tuple(color))
+
+	return(colors, windy)
 
 
 
@@ -279,7 +458,7 @@ def calc_target_colors (stations, conditions):  # calculate an array of bulb sta
 
 initialize_logging()
 
-logging.info ("Running metar.py at %s", datetime.datetime.now().strftime('%d/%m/%Y %H:%M'))
+logger.info("Running metar.py at %s", datetime.datetime.now().strftime('%d/%m/%Y %H:%M'))
 
 calc_daytime()
 
@@ -289,75 +468,69 @@ calc_daytime()
 # ------------START OF MAIN DISPLAY LOOP-------------------------------------
 # ---------------------------------------------------------------------------
 
+frame = np.zeros((LED_COUNT, 3), dtype=np.uint8)	# whole-strip staging buffer, written to the pixels in one go
+
+pixels,disp = initialize_display_and_leds()
+blinker = BlinkScheduler(pixels, BLINK_SPEED, FAST_BLINK_SPEED)
+stations = None
+conditionDict = None
 
 while True:
-	pixels,disp = initialize_display_and_leds()
 	airports = get_airport_list()
-
-	conditionDict=False
-	while not conditionDict:
-		conditionDict = get_weather(airports)
-
-	ledstate = calc_target_colors(airports,conditionDict)
+	if stations is None or stations.codes is not airports:
+		stations = StationArrays(airports)
+
+	newConditions = None
+	while not newConditions:
+		newConditions = get_weather(stations)
+
+	if newConditions is not conditionDict:
+		conditionDict = newConditions
+		# New weather - rebuild the LEDs and the set of blinking stations
+		colors, windy = calc_target_colors(stations)
+		ledstate = list(zip(map(tuple, colors.tolist()), windy.tolist()))
+
+		# Stage the whole strip in the frame buffer and update actual LEDs all at once
+		n = min(len(colors), LED_COUNT)
+		frame.fill(0)
+		frame[:n] = colors[:n]
+
+		for p, (color, blink) in enumerate(ledstate):
+			if blink:
+				logger.debug("%sblinking station %s", timestamp(), p)
+
+		# Show the complete frame first, then hand the windy stations to the scheduler thread,
+		# all under its lock so it can't blank anything from the old blink set in between
+		with blinker.lock:
+			pixels.brightness = led_brightness()
+			pixels[:] = frame.tolist()
+			pixels.show()
+			blinker.set_state([(p, color, windy) for p, (color, windy) in enumerate(ledstate)])
+	else:
+		# Same weather - leave the strip and the blinking as they are, just keep the dimming up to date
+		with blinker.lock:
+			pixels.brightness = led_brightness()
+			pixels.show()
 
 	num_display_loops = int(REFRESH_TIME_SECONDS/(DISPLAY_ROTATION_SPEED*len(airports)))
-	threadarray=[]
-
-	for p in range(len(ledstate)):
-		pixels[p],b = ledstate[p]
-		# Update actual LEDs all at once
-
-	# for windy stations, spin up a blinky thread per station and store a pointer to each thread in threadarray
-	for p in range(len(ledstate)):
-		if ledstate[p][1]:
-			logging.debug(timestamp()+"blinking station %s", str(p))
-
-			x = threading.Thread(target=blinkme, args=(p,ledstate[p][0],9999,BLINK_SPEED))  # very long blink period - assume the thread will get killed
-			x.start()
-			threadarray.append(x)
-		else:
-			threadarray.append('')
-
-	pixels.show()
 
 	if disp is not None:	# Rotate through airports METAR on external display until it's time to refresh the weather
-
+		# pace the rotation against monotonic deadlines so time spent drawing the display doesn't stretch the refresh cycle
+		deadline = time.monotonic()
 		for l in range(num_display_loops):
-			logging.debug(timestamp()+"Starting loop %s of %s",str(l),str(num_display_loops))
-
-			p = 0
-			for metarStation in airports:
-# if this station is blinking, and we are fastblinking, kill that thread
-				if FAST_BLINK_DISPLAYED_STATION and ledstate[p][1]:
-					STOPFLAG = p
-					threadarray[p].join()  #pauses until the thread is dead
-					STOPFLAG = DONTSTOP
+			logger.debug("%sStarting loop %s of %s", timestamp(), l, num_display_loops)
 
+			for p, metarStation in enumerate(airports):
 				if metarStation != "NULL" and conditionDict.get(metarStation):
-					logging.debug(timestamp()+"Showing METAR Display for %s %s", str(p) , metarStation)
+					logger.debug("%sShowing METAR Display for %s %s", timestamp(), p, metarStation)
 					displaymetar.outputMetar(disp, metarStation, conditionDict.get(metarStation))
+					deadline += DISPLAY_ROTATION_SPEED
 					if FAST_BLINK_DISPLAYED_STATION:
-						thiscolor, b  = ledstate[p]
-						blinkme (p, thiscolor, DISPLAY_ROTATION_SPEED, FAST_BLINK_SPEED)
-					# reset the pixel
-						pixels[p],b =ledstate[p]
-# restart the blinking thread if needed
-						if ledstate[p][1]:
-							threadarray[p] = threading.Thread(target=blinkme, args=(p,ledstate[p][0],9999,BLINK_SPEED))  # very long blink period - assume the thread will get killed
-							threadarray[p].start()
-						pixels.show()
-					else:
-						sleep(DISPLAY_ROTATION_SPEED)
-				p += 1
-
-		logging.info (timestamp()+'...kill all the threads...')
-# kill all the windy loops bafore refreshing
-		for p in range(len(ledstate)):
-			if ledstate[p][1]:
-				STOPFLAG = p
-				threadarray[p].join()
-				STOPFLAG = DONTSTOP
+# the scheduler fast blinks this station on its own ticks, then resets the pixel
+						blinker.set_fast_blink(p, ledstate[p][0], max(0.0, deadline - time.monotonic()))
+					sleep(max(0.0, deadline - time.monotonic()))
 
 	else:
 		sleep(REFRESH_TIME_SECONDS)   #If there's no display, then just pause for the refresh time
-	logging.info (timestamp()+'ready to refresh the weather')
+
+	logger.info('%sready to refresh the weather', timestamp())